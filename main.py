@@ -5,30 +5,130 @@ A tool to analyze and visualize daily merge counts for GitHub repositories.
 """
 
 import argparse
+import math
 import os
 import re
 import sys
-from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Dict, List, Optional, Tuple
-import requests
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+from datetime import datetime, time, timedelta
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# requests, numpy and matplotlib are imported where they are first needed so
+# that --help and argument errors don't pay for loading them
+if TYPE_CHECKING:
+    import requests
+
+# orjson is optional; it decodes large API responses faster than the stdlib
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# ijson is optional; it lets pull request pages be filtered while they download
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+# Number of result pages fetched concurrently
+MAX_WORKERS = 8
+
+# Maximum number of results the search API returns for a single query
+SEARCH_RESULT_LIMIT = 1000
+
+# On-disk HTTP cache used when requests-cache is installed
+CACHE_NAME = '~/.cache/gh-merge'
+CACHE_EXPIRE_AFTER = 3600  # seconds
+
+# Graph file written when no terminal is attached and --output is not given
+DEFAULT_OUTPUT = 'merges.png'
+
+# GraphQL search for merged PRs that selects nothing but the merge time
+_MERGED_PRS_QUERY = """
+query($query: String!, $cursor: String) {
+  search(query: $query, type: ISSUE, first: 100, after: $cursor) {
+    issueCount
+    pageInfo { hasNextPage endCursor }
+    nodes { ... on PullRequest { mergedAt } }
+  }
+}
+"""
+
+# Block characters for --ascii output, indexed by height from 0 to 8
+SPARK_BLOCKS = ' ▁▂▃▄▅▆▇█'
+
+# Supported GitHub repository URL formats
+_URL_PATTERNS = (
+    re.compile(r'github\.com[:/]([^/]+)/([^/]+?)(?:\.git)?/?$'),
+    re.compile(r'^([^/]+)/([^/]+)$')  # owner/repo format
+)
+
+
+def _parse_json(response: 'requests.Response'):
+    """Decode a JSON response body, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def _iter_json_items(response: 'requests.Response', stream: bool) -> Iterator[Dict]:
+    """Iterate over a JSON array response, decoding it with ijson as it arrives if stream is set."""
+    if stream:
+        response.raw.decode_content = True
+        return ijson.items(response.raw, 'item', use_float=True)
+    return iter(_parse_json(response))
 
 
 class GitHubAnalytics:
     """GitHub repository merge analytics tool."""
     
     def __init__(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        
         self.api_base = "https://api.github.com"
-        self.session = requests.Session()
+        self._figure = None
+        self._axes = None
+        self._stats_text = None
+        
+        # Cache responses on disk when requests-cache is installed, so repeat
+        # runs are served locally or revalidated with cheap 304 responses
+        try:
+            import requests_cache
+        except ImportError:
+            self.session = requests.Session()
+            self._stream_pages = ijson is not None
+        else:
+            # The cache reads and stores the whole body of every response, so
+            # pages are never streamed through ijson on a cached session
+            self._stream_pages = False
+            self.session = requests_cache.CachedSession(
+                cache_name=os.path.expanduser(CACHE_NAME),
+                backend='sqlite',
+                expire_after=CACHE_EXPIRE_AFTER,
+                cache_control=True,
+                allowable_methods=('GET', 'HEAD', 'POST')  # POST for GraphQL queries
+            )
+        
         # Set user agent as required by GitHub API
         self.session.headers.update({
-            'User-Agent': 'github-merge-analytics/1.0'
+            'User-Agent': 'github-merge-analytics/1.0',
+            'Accept': 'application/vnd.github+json'
         })
+        # Keep connections alive across concurrent page fetches and retry
+        # transient gateway errors instead of failing the whole run
+        retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+        self.session.mount('https://', adapter)
         
         # Add GitHub token authentication if available
         github_token = os.getenv('GITHUB_TOKEN')
+        self.authenticated = bool(github_token)
         if github_token:
             self.session.headers.update({
                 'Authorization': f'Bearer {github_token}'
@@ -39,146 +139,345 @@ class GitHubAnalytics:
     
     def parse_repo_url(self, url: str) -> Tuple[str, str]:
         """Parse GitHub repository URL to extract owner and repo name."""
-        # Match various GitHub URL formats
-        patterns = [
-            r'github\.com[:/]([^/]+)/([^/]+?)(?:\.git)?/?$',
-            r'^([^/]+)/([^/]+)$'  # owner/repo format
-        ]
+        # Fast path: reduce URLs to owner/repo and split without regex
+        path = url.rstrip('/')
+        if path.endswith('.git'):
+            path = path[:-len('.git')]
+        if path.startswith(('http://', 'https://', 'git@')) and 'github.com' in path:
+            path = path.split('github.com', 1)[1].lstrip(':/')
+        owner, sep, repo = path.partition('/')
+        if owner and sep and repo and '/' not in repo:
+            return owner, repo
         
-        for pattern in patterns:
-            match = re.search(pattern, url)
+        # Match various GitHub URL formats
+        for pattern in _URL_PATTERNS:
+            match = pattern.search(url)
             if match:
                 owner, repo = match.groups()
                 return owner, repo
         
         raise ValueError(f"Invalid GitHub repository URL: {url}")
     
+    def _fetch_page(self, url: str, params: Dict, page: int, stream: bool = False) -> 'requests.Response':
+        """Fetch a single page of results from the GitHub API."""
+        response = self.session.get(url, params={**params, 'page': page}, stream=stream)
+        self._check_rate_limit(response)
+        response.raise_for_status()
+        
+        return response
+    
+    def _check_rate_limit(self, response: 'requests.Response'):
+        """Exit with a message if the request was rejected by the API rate limit."""
+        # GitHub reports the remaining quota in the headers of every response,
+        # so the body never has to be decoded to detect this
+        if response.ok or response.headers.get('X-RateLimit-Remaining') != '0':
+            return
+        
+        reset = response.headers.get('X-RateLimit-Reset')
+        if reset:
+            reset_time = datetime.fromtimestamp(int(reset)).strftime('%H:%M:%S')
+            print(f"Rate limit exceeded (resets at {reset_time}). Please wait or use authentication.")
+        else:
+            print("Rate limit exceeded. Please wait or use authentication.")
+        sys.exit(1)
+    
     def fetch_merged_prs(self, owner: str, repo: str, since_date: datetime) -> List[Dict]:
         """Fetch merged pull requests since the given date."""
-        url = f"{self.api_base}/repos/{owner}/{repo}/pulls"
+        import requests
+        
+        # Let the search API filter for merged PRs in the date range server-side
+        url = f"{self.api_base}/search/issues"
+        since_iso = since_date.strftime('%Y-%m-%dT%H:%M:%S')
         params = {
-            'state': 'closed',
-            'sort': 'updated',
-            'direction': 'desc',
+            'q': f'repo:{owner}/{repo} is:pr is:merged merged:>={since_iso}',
             'per_page': 100
         }
         
-        merged_prs = []
-        page = 1
-        
-        while True:
-            params['page'] = page
+        try:
+            result = _parse_json(self._fetch_page(url, params, 1))
+            
+            # The search API only returns the first 1000 results, so fall back
+            # to walking the pulls endpoint when there are more
+            if result['total_count'] > SEARCH_RESULT_LIMIT:
+                return self._fetch_merged_prs_from_pulls(owner, repo, since_date)
             
-            try:
-                response = self.session.get(url, params=params)
+            items = result['items']
+            last_page = math.ceil(result['total_count'] / params['per_page'])
+            if last_page > 1:
+                with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                    results = executor.map(
+                        lambda page: _parse_json(self._fetch_page(url, params, page)),
+                        range(2, last_page + 1)
+                    )
+                    for page_result in results:
+                        items.extend(page_result['items'])
+        
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching data from GitHub API: {e}")
+            sys.exit(1)
+        
+        # Search results are issues, so expose the merge time the way pulls do
+        for item in items:
+            item['merged_at'] = item['pull_request']['merged_at']
+        
+        return items
+    
+    def fetch_merged_prs_graphql(self, owner: str, repo: str, since_date: datetime) -> List[Dict]:
+        """Fetch merge times of pull requests merged since the given date via GraphQL."""
+        import requests
+        
+        url = f"{self.api_base}/graphql"
+        since_iso = since_date.strftime('%Y-%m-%dT%H:%M:%S')
+        variables = {
+            'query': f'repo:{owner}/{repo} is:pr is:merged merged:>={since_iso}',
+            'cursor': None
+        }
+        
+        merged_prs = []
+        try:
+            while True:
+                response = self.session.post(url, json={'query': _MERGED_PRS_QUERY, 'variables': variables})
+                self._check_rate_limit(response)
                 response.raise_for_status()
                 
-                # Check rate limiting
-                if response.status_code == 403 and 'rate limit' in response.text.lower():
-                    print("Rate limit exceeded. Please wait or use authentication.")
+                result = _parse_json(response)
+                if result.get('errors'):
+                    print(f"Error fetching data from GitHub API: {result['errors'][0]['message']}")
                     sys.exit(1)
                 
-                prs = response.json()
-                if not prs:
-                    break
-                
-                # Filter for merged PRs within our date range
-                for pr in prs:
-                    if pr['merged_at']:
-                        merged_at = datetime.fromisoformat(pr['merged_at'].replace('Z', '+00:00'))
-                        if merged_at.replace(tzinfo=None) >= since_date:
-                            merged_prs.append(pr)
-                        else:
-                            # Since PRs are sorted by updated date, we can stop here
-                            # if we encounter an old PR (though this isn't perfect)
-                            pass
+                search = result['data']['search']
                 
-                # Check if we should continue to next page
-                if len(prs) < 100:
-                    break
+                # GraphQL search is capped at 1000 results just like the REST one
+                if search['issueCount'] > SEARCH_RESULT_LIMIT:
+                    return self._fetch_merged_prs_from_pulls(owner, repo, since_date)
                 
-                page += 1
+                merged_prs.extend({'merged_at': node['mergedAt']} for node in search['nodes'])
                 
-            except requests.exceptions.RequestException as e:
-                print(f"Error fetching data from GitHub API: {e}")
-                sys.exit(1)
+                if not search['pageInfo']['hasNextPage']:
+                    break
+                variables['cursor'] = search['pageInfo']['endCursor']
+        
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching data from GitHub API: {e}")
+            sys.exit(1)
+        
+        return merged_prs
+    
+    def _fetch_merged_prs_from_pulls(self, owner: str, repo: str, since_date: datetime) -> List[Dict]:
+        """Fetch merged pull requests since the given date from the pulls endpoint."""
+        import requests
+        import urllib3
+        
+        url = f"{self.api_base}/repos/{owner}/{repo}/pulls"
+        params = {
+            'state': 'closed',
+            'sort': 'updated',
+            'direction': 'desc',
+            'per_page': 100
+        }
+        
+        # GitHub timestamps are always 'YYYY-MM-DDTHH:MM:SSZ', so the cutoff
+        # check can be done as a plain string comparison
+        since_iso = since_date.strftime('%Y-%m-%dT%H:%M:%S')
+        
+        def fetch_and_filter(page: int) -> Tuple[List[Dict], Optional[str]]:
+            response = self._fetch_page(url, params, page, stream=self._stream_pages)
+            return self._filter_pulls_page(response, since_iso)
+        
+        merged_prs = []
+        try:
+            # The first page tells us how many pages there are via the Link header
+            response = self._fetch_page(url, params, 1, stream=self._stream_pages)
+            last_link = response.links.get('last')
+            last_page = int(parse_qs(urlparse(last_link['url']).query)['page'][0]) if last_link else 1
+            prs, last_updated = self._filter_pulls_page(response, since_iso)
+            merged_prs.extend(prs)
+            
+            # Pages are independent URLs, so fetch the remaining ones concurrently
+            if last_page > 1 and not self._ends_before_cutoff(last_updated, since_iso):
+                with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                    # Keep only MAX_WORKERS pages in flight so that stopping
+                    # early wastes few requests
+                    remaining_pages = iter(range(2, last_page + 1))
+                    futures = deque(
+                        executor.submit(fetch_and_filter, page)
+                        for page in islice(remaining_pages, MAX_WORKERS)
+                    )
+                    try:
+                        while futures:
+                            prs, last_updated = futures.popleft().result()
+                            merged_prs.extend(prs)
+                            if self._ends_before_cutoff(last_updated, since_iso):
+                                break
+                            for page in islice(remaining_pages, 1):
+                                futures.append(executor.submit(fetch_and_filter, page))
+                    finally:
+                        for future in futures:
+                            future.cancel()
+        
+        # Streamed pages are read from the raw urllib3 response, so errors
+        # while decoding them are not wrapped in RequestException
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+            print(f"Error fetching data from GitHub API: {e}")
+            sys.exit(1)
         
         return merged_prs
     
+    def _filter_pulls_page(self, response: 'requests.Response', since_iso: str) -> Tuple[List[Dict], Optional[str]]:
+        """Collect the PRs on a pulls page merged since the cutoff.
+        
+        Returns them along with the page's last updated_at, or None for an empty page.
+        """
+        merged_prs = []
+        last_updated = None
+        with response:
+            # Filter for merged PRs within our date range as they are decoded
+            for pr in _iter_json_items(response, self._stream_pages):
+                last_updated = pr['updated_at']
+                if pr['merged_at'] and pr['merged_at'] >= since_iso:
+                    merged_prs.append(pr)
+        
+        return merged_prs, last_updated
+    
+    @staticmethod
+    def _ends_before_cutoff(last_updated: Optional[str], since_iso: str) -> bool:
+        """Check whether a page of PRs sorted by updated date ends before the cutoff."""
+        # A PR is always merged before its last update, so no later page
+        # can contain a PR merged after the cutoff
+        return last_updated is not None and last_updated < since_iso
+    
     def process_daily_counts(self, merged_prs: List[Dict], days: int = 30) -> Dict[str, int]:
         """Process merged PRs into daily counts."""
-        daily_counts = defaultdict(int)
-        
-        # Initialize all days in the range with 0
-        end_date = datetime.now()
-        for i in range(days):
-            date = end_date - timedelta(days=i)
-            date_str = date.strftime('%Y-%m-%d')
-            daily_counts[date_str] = 0
-        
-        # Count merges by day
-        for pr in merged_prs:
-            if pr['merged_at']:
-                merged_at = datetime.fromisoformat(pr['merged_at'].replace('Z', '+00:00'))
-                date_str = merged_at.strftime('%Y-%m-%d')
-                if date_str in daily_counts:
-                    daily_counts[date_str] += 1
-        
-        return dict(daily_counts)
-    
-    def generate_graph(self, daily_counts: Dict[str, int], owner: str, repo: str):
-        """Generate and display a graph of daily merge counts."""
+        import numpy as np
+        
+        end_date = datetime.now().date()
+        
+        # Convert merge dates to day offsets from today and count them in one pass
+        merged_days = np.array(
+            [pr['merged_at'][:10] for pr in merged_prs if pr['merged_at']],
+            dtype='datetime64[D]'
+        )
+        offsets = (np.datetime64(end_date, 'D') - merged_days).astype(np.int64)
+        offsets = offsets[(offsets >= 0) & (offsets < days)]
+        counts = np.bincount(offsets, minlength=days)
+        
+        # Offset i is i days before today
+        dates = [(end_date - timedelta(days=i)).isoformat() for i in range(days)]
+        return dict(zip(dates, counts.tolist()))
+    
+    def generate_graph(self, daily_counts: Dict[str, int], owner: str, repo: str,
+                       output: Optional[str] = None):
+        """Generate a graph of daily merge counts and display it or save it to a file."""
         # Sort dates
         sorted_dates = sorted(daily_counts.keys())
-        dates = [datetime.strptime(date, '%Y-%m-%d') for date in sorted_dates]
+        dates = [datetime.fromisoformat(date) for date in sorted_dates]
         counts = [daily_counts[date] for date in sorted_dates]
         
+        # Reuse the figure from a previous call instead of allocating a new one
+        if output:
+            reusable = self._figure is not None
+        else:
+            import matplotlib.pyplot as plt
+            # Only pyplot can show a window, and not again once it was closed
+            reusable = plt.fignum_exists(getattr(self._figure, 'number', None))
+        
+        if reusable:
+            self._axes.clear()
+        else:
+            if output:
+                # Draw straight onto an Agg canvas; pyplot's global state and
+                # backend setup are only needed to display a window
+                from matplotlib.backends.backend_agg import FigureCanvasAgg
+                from matplotlib.figure import Figure
+                self._figure = Figure(figsize=(12, 6))
+                FigureCanvasAgg(self._figure)
+                self._axes = self._figure.add_subplot()
+            else:
+                self._figure, self._axes = plt.subplots(figsize=(12, 6))
+            self._stats_text = self._figure.text(0.5, 0.02, '', ha='center',
+                                                 fontsize=10, style='italic')
+        fig, ax = self._figure, self._axes
+        
         # Create the plot
-        plt.figure(figsize=(12, 6))
-        plt.plot(dates, counts, marker='o', linewidth=2, markersize=4)
-        plt.title(f'Daily Merge Count - {owner}/{repo}\n(Past {len(dates)} days)', 
-                  fontsize=14, fontweight='bold')
-        plt.xlabel('Date', fontsize=12)
-        plt.ylabel('Number of Merges', fontsize=12)
-        plt.grid(True, alpha=0.3)
-        
-        # Format x-axis
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%m/%d'))
-        plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=max(1, len(dates)//10)))
-        plt.xticks(rotation=45)
+        ax.plot(dates, counts, marker='o', linewidth=2, markersize=4)
+        ax.set_title(f'Daily Merge Count - {owner}/{repo}\n(Past {len(dates)} days)',
+                     fontsize=14, fontweight='bold')
+        ax.set_xlabel('Date', fontsize=12)
+        ax.set_ylabel('Number of Merges', fontsize=12)
+        ax.grid(True, alpha=0.3)
+        
+        # Format x-axis; the dates are known up front, so place the ticks
+        # directly instead of having a date locator compute them on draw
+        tick_dates = dates[::max(1, len(dates)//10)]
+        ax.set_xticks(tick_dates)
+        ax.set_xticklabels([date.strftime('%m/%d') for date in tick_dates], rotation=45)
         
         # Add some statistics
+        self._stats_text.set_text(self._format_stats(counts))
+        
+        fig.tight_layout()
+        if output:
+            fig.savefig(output, dpi=100)
+            print(f"Graph saved to {output}")
+        else:
+            plt.show()
+    
+    def render_sparkline(self, daily_counts: Dict[str, int], owner: str, repo: str):
+        """Print daily merge counts as a Unicode sparkline."""
+        sorted_dates = sorted(daily_counts.keys())
+        counts = [daily_counts[date] for date in sorted_dates]
+        
+        # Scale each day to one of eight block heights, keeping any non-zero
+        # day visible; days without merges are left blank
+        max_count = max(counts, default=0) or 1
+        sparkline = ''.join(SPARK_BLOCKS[math.ceil(count * 8 / max_count)] for count in counts)
+        
+        print(f"Daily Merge Count - {owner}/{repo} (Past {len(counts)} days)")
+        if sorted_dates:
+            # Label both ends as MM/DD, like the graph's x-axis
+            first, last = (date[5:].replace('-', '/') for date in (sorted_dates[0], sorted_dates[-1]))
+            print(f"{first} {sparkline} {last}")
+        print(self._format_stats(counts))
+    
+    @staticmethod
+    def _format_stats(counts: List[int]) -> str:
+        """Summarize daily merge counts as total, average and peak."""
         total_merges = sum(counts)
         avg_merges = total_merges / len(counts) if counts else 0
         max_merges = max(counts) if counts else 0
         
-        stats_text = f'Total: {total_merges} | Avg: {avg_merges:.1f}/day | Peak: {max_merges}'
-        plt.figtext(0.5, 0.02, stats_text, ha='center', fontsize=10, style='italic')
-        
-        plt.tight_layout()
-        plt.show()
+        return f'Total: {total_merges} | Avg: {avg_merges:.1f}/day | Peak: {max_merges}'
     
-    def analyze_repository(self, repo_url: str, days: int = 30):
+    def analyze_repository(self, repo_url: str, days: int = 30, output: Optional[str] = None,
+                           sparkline: bool = False):
         """Main method to analyze a repository."""
         try:
             # Parse repository URL
             owner, repo = self.parse_repo_url(repo_url)
             print(f"Analyzing repository: {owner}/{repo}")
             
-            # Calculate date range
-            since_date = datetime.now() - timedelta(days=days)
+            # Calculate date range, starting at midnight of the oldest day that
+            # process_daily_counts reports so the window matches the graph
+            today = datetime.now().date()
+            since_date = datetime.combine(today - timedelta(days=days - 1), time.min)
             print(f"Fetching merge data from {since_date.strftime('%Y-%m-%d')} to present...")
             
-            # Fetch merged PRs
-            merged_prs = self.fetch_merged_prs(owner, repo, since_date)
+            # Fetch merged PRs; GraphQL transfers far less data but needs a token
+            if self.authenticated:
+                merged_prs = self.fetch_merged_prs_graphql(owner, repo, since_date)
+            else:
+                merged_prs = self.fetch_merged_prs(owner, repo, since_date)
             print(f"Found {len(merged_prs)} merged pull requests in the specified period.")
             
             # Process daily counts
             daily_counts = self.process_daily_counts(merged_prs, days)
             
             # Generate graph
-            self.generate_graph(daily_counts, owner, repo)
-            
+            if sparkline:
+                self.render_sparkline(daily_counts, owner, repo)
+            else:
+                self.generate_graph(daily_counts, owner, repo, output)
+        
         except ValueError as e:
             print(f"Error: {e}")
             sys.exit(1)
@@ -207,6 +506,17 @@ def main():
         help='Number of days to analyze (default: 30)'
     )
     
+    output_group = parser.add_mutually_exclusive_group()
+    output_group.add_argument(
+        '--output',
+        help='Save the graph to this file instead of displaying it (e.g., merges.png)'
+    )
+    output_group.add_argument(
+        '--ascii',
+        action='store_true',
+        help='Print a text sparkline in the terminal instead of drawing a graph'
+    )
+    
     args = parser.parse_args()
     
     # Validate days parameter
@@ -214,9 +524,14 @@ def main():
         print("Error: --days must be a positive integer")
         sys.exit(1)
     
+    # Save to a file when no terminal is attached to display the graph
+    output = args.output
+    if output is None and not args.ascii and not sys.stdout.isatty():
+        output = DEFAULT_OUTPUT
+    
     # Create analyzer and run analysis
     analyzer = GitHubAnalytics()
-    analyzer.analyze_repository(args.repo, args.days)
+    analyzer.analyze_repository(args.repo, args.days, output, args.ascii)
 
 
 if __name__ == '__main__':